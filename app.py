@@ -3,19 +3,43 @@ import json
 import os
 import re
 import uuid
-import requests
-import fitz  
+import random
+import zlib
+import hashlib
+import threading
+import shutil
+import zipfile
+import click
+import importlib
+import importlib.util
 import base64
+import io
+from contextlib import contextmanager
+import urllib.parse
+from html.parser import HTMLParser
 from flask_login import (
     LoginManager, UserMixin,
     login_user, logout_user,
     login_required, current_user
 )
 from werkzeug.security import generate_password_hash, check_password_hash
-try:
-    from openrouter import OpenRouter
-except ImportError:
-    OpenRouter = None
+
+class LazyModule:
+    # Stands in for a heavy module and imports it the first time it's used, so
+    # workers that never parse a PDF or call out to the network don't pay for it
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+fitz = LazyModule('fitz')
+requests = LazyModule('requests')
+# Checked without importing it, the SDK is only loaded when the AI is first used
+has_openrouter = importlib.util.find_spec('openrouter') is not None
 
 app = Flask(__name__)
 
@@ -226,6 +250,149 @@ def parse_hybrid_quizlet_pdf(pdf_stream):
 
     return title, final_cards
 
+# --- Near-duplicate card detection ---
+# Cards are shingled into character 5-grams and MinHashed. Signatures are split
+# into LSH bands so each card is only compared against cards that share a band,
+# which keeps dedup roughly linear in the number of cards.
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16
+DEDUP_SHINGLE = 5
+DEDUP_THRESHOLD = 0.7
+# On top of that the answers have to mostly share their words, so short cards
+# that only differ in the key token ("World War I ... 1914" vs "World War II
+# ... 1939") are kept
+DEDUP_ANSWER_THRESHOLD = 0.5
+# Each "permutation" is an XOR with a fixed random mask over the shingle hash,
+# which lets min() run over map() in C instead of a Python loop. Hashes are kept
+# to 30 bits so CPython can use its fast single digit ints.
+_minhash_rng = random.Random(5318008)
+DEDUP_MASKS = [_minhash_rng.getrandbits(30) for _ in range(DEDUP_NUM_PERM)]
+
+def card_text(card):
+    text = f"{card.get('question') or ''} {card.get('answer') or ''}"
+    text = re.sub(r'<[^>]+>', ' ', text).lower()
+    return re.sub(r'[\W_]+', ' ', text).strip()
+
+def answer_words(card):
+    text = re.sub(r'<[^>]+>', ' ', str(card.get('answer') or '')).lower()
+    return frozenset(re.sub(r'[\W_]+', ' ', text).split())
+
+def minhash_signature(text):
+    if len(text) <= DEDUP_SHINGLE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + DEDUP_SHINGLE] for i in range(len(text) - DEDUP_SHINGLE + 1)}
+    hashes = [zlib.crc32(sh.encode('utf-8')) & 0x3FFFFFFF for sh in shingles]
+    return [min(map(mask.__xor__, hashes)) for mask in DEDUP_MASKS]
+
+class CardDeduper:
+    # LSH index of cards seen so far. Cards with different images never count as
+    # duplicates of each other, so image-only cards with the same caption survive.
+    def __init__(self, existing=()):
+        self.rows = DEDUP_NUM_PERM // DEDUP_BANDS
+        self.buckets = {}
+        self.signatures = []
+        self.answers = []
+        for card in existing:
+            if isinstance(card, dict):
+                self.add(card)
+
+    def add(self, card):
+        # Returns False if card is a near-duplicate of one already added
+        image = card.get('image')
+        image_key = hashlib.sha1(image.encode('utf-8')).hexdigest() if isinstance(image, str) and image else ''
+        sig = minhash_signature(card_text(card))
+        answer = answer_words(card)
+        band_keys = [(image_key, b, tuple(sig[b * self.rows:(b + 1) * self.rows])) for b in range(DEDUP_BANDS)]
+        candidates = set()
+        for key in band_keys:
+            candidates.update(self.buckets.get(key, ()))
+        for idx in candidates:
+            other = self.signatures[idx]
+            agree = sum(1 for x, y in zip(sig, other) if x == y)
+            if agree / DEDUP_NUM_PERM >= DEDUP_THRESHOLD and self.same_answer(answer, self.answers[idx]):
+                return False
+        self.signatures.append(sig)
+        self.answers.append(answer)
+        for key in band_keys:
+            self.buckets.setdefault(key, []).append(len(self.signatures) - 1)
+        return True
+
+    @staticmethod
+    def same_answer(a, b):
+        if not a or not b:
+            return a == b
+        return len(a & b) / len(a | b) >= DEDUP_ANSWER_THRESHOLD
+
+def dedupe_cards(cards, existing=()):
+    # Returns (kept, dropped)
+    if not isinstance(cards, list):
+        cards = [cards]
+    deduper = CardDeduper(existing)
+    kept = []
+    dropped = []
+    for card in cards:
+        (kept if isinstance(card, dict) and deduper.add(card) else dropped).append(card)
+    return kept, dropped
+
+EXIT_ARRAY_RE = re.compile(r'exit\(\s*(?:```(?:json)?\s*)?\[')
+
+class CardStreamParser:
+    # Pulls cards out of a streamed exit([...]) call as soon as each object
+    # closes, without waiting for the rest of the array
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.in_array = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.obj_start = 0
+        self.cards = []
+
+    def feed(self, text):
+        search_from = max(0, len(self.buffer) - 20)
+        self.buffer += text
+        new_cards = []
+        if not self.in_array:
+            match = EXIT_ARRAY_RE.search(self.buffer, search_from)
+            if not match:
+                return new_cards
+            self.in_array = True
+            self.pos = match.end()
+
+        while self.pos < len(self.buffer) and not self.done:
+            ch = self.buffer[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.depth:
+                self.in_string = True
+            elif ch == '{':
+                if self.depth == 0:
+                    self.obj_start = self.pos
+                self.depth += 1
+            elif ch == '}' and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        card = json.loads(self.buffer[self.obj_start:self.pos + 1])
+                    except json.JSONDecodeError:
+                        card = None
+                    if isinstance(card, dict):
+                        new_cards.append(card)
+            elif ch == ']' and self.depth == 0:
+                self.done = True
+            self.pos += 1
+
+        self.cards.extend(new_cards)
+        return new_cards
+
 class User(UserMixin):
     def __init__(self, id, username, password_hash):
         self.id = id
@@ -244,6 +411,62 @@ def readjson(file):
         return data
     return []
 
+def writejson(file, data):
+    writetext(file, json.dumps(data, indent=4))
+
+def writetext(file, text):
+    # Write to a temp file and swap it in so readers never see a half written file
+    path = f'{root}{file}'
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+# One lock per user so concurrent requests don't clobber each other's writes.
+# Reentrant so helpers that take the lock can be called while it is held.
+user_locks = {}
+user_locks_guard = threading.Lock()
+
+@contextmanager
+def user_lock(user_id):
+    with user_locks_guard:
+        lock = user_locks.setdefault(str(user_id), threading.RLock())
+    with lock:
+        # Finish any commit a crashed worker left half written before anyone
+        # reads or writes this user's files
+        replay_journal(user_id)
+        yield
+
+# Writes that have to land together (the counters and the sync keys that say
+# they were applied) go through journal.json. Writing the journal is the commit:
+# once it's on disk each file is swapped in and the journal removed, and if we
+# die in between replay_journal() finishes the job the next time the user's
+# lock is taken.
+def commit_user_files(user_id, files):
+    # files maps a file name in user_data/<id> to its new contents.
+    # Caller must hold user_lock(user_id). Each file is serialized once, the
+    # journal is put together from the same text.
+    texts = {name: json.dumps(data, indent=4) for name, data in files.items()}
+    journal = ',\n'.join(f'{json.dumps(name)}: {text}' for name, text in texts.items())
+    writetext(f'user_data/{user_id}/journal.json', '{' + journal + '}')
+    apply_journal(user_id, texts)
+
+def apply_journal(user_id, texts):
+    for name, text in texts.items():
+        writetext(f'user_data/{user_id}/{name}', text)
+    os.remove(f'{root}user_data/{user_id}/journal.json')
+
+def replay_journal(user_id):
+    # Only does anything after a crash mid commit
+    journal = f'user_data/{user_id}/journal.json'
+    if not os.path.exists(f'{root}{journal}'):
+        return
+    files = readjson(journal)
+    if isinstance(files, dict):
+        apply_journal(user_id, {name: json.dumps(data, indent=4) for name, data in files.items()})
+    else:
+        os.remove(f'{root}{journal}')
+
 def load_users():
     return readjson("users.json")
 
@@ -260,6 +483,9 @@ ai_key = ""
 search_key = ""
 model = ""
 port = 5000
+providers_config = {}
+pdf_cache_mb = 256
+web_cache_config = {}
 if os.path.exists('keys.json'):
     with open('keys.json') as f:
         keys = json.load(f)
@@ -267,63 +493,547 @@ if os.path.exists('keys.json'):
         search_key = keys[0]['hcsearch']
         model = keys[0]['model']
         port = keys[0]['port']
+        providers_config = keys[0].get('providers', {})
+        pdf_cache_mb = keys[0].get('pdf_cache_mb', 256)
+        web_cache_config = keys[0].get('web_cache', {})
+
+import time
+
+# --- Upstream providers ---
+# Chat completion, search and page fetch go through these so keys.json can swap
+# the real services for local stand-ins, e.g.
+#   "providers": {"chat": {"type": "local", "latency": 0.5, "rate_limit_rate": 0.1}}
+# Real providers take a "record" path that saves responses as fixtures, and the
+# local ones replay fixtures from a "fixtures" path (synthesizing anything missing).
+class ProviderError(Exception):
+    pass
+
+fixture_lock = threading.Lock()
+
+def load_fixtures(path):
+    data = readjson(path) if path else {}
+    return data if isinstance(data, dict) else {}
+
+def record_fixture(path, key, value):
+    with fixture_lock:
+        data = load_fixtures(path)
+        data[key] = value
+        writejson(path, data)
+
+def prompt_key(prompt):
+    return hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+
+class OpenRouterChat:
+    def __init__(self, api_key, model, server_url, record=None):
+        self.api_key = api_key
+        self.server_url = server_url
+        self.model = model
+        self.record = record
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Built on first use, importing the SDK takes a while and a lot of memory
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from openrouter import OpenRouter
+                    self._client = OpenRouter(api_key=self.api_key, server_url=self.server_url)
+        return self._client
+
+    def complete(self, prompt):
+        response = self.client.chat.send(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=False,
+        )
+        text = response.choices[0].message.content
+        if self.record:
+            record_fixture(self.record, prompt_key(prompt), text)
+        return text
+
+    def stream(self, prompt):
+        response = self.client.chat.send(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+        )
+        parts = []
+        with response as events:
+            for chunk in events:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if isinstance(content, str) and content:
+                    parts.append(content)
+                    yield content
+        if self.record:
+            record_fixture(self.record, prompt_key(prompt), "".join(parts))
+
+class HackclubSearch:
+    # search type -> (path, how to pull the results list out of the response)
+    endpoints = {
+        "web": ("web/search", lambda data: data.get('web', {}).get('results', [])),
+        "image": ("images/search", lambda data: data.get('results', [])),
+        "news": ("news/search", lambda data: data.get('news', {}).get('results', [])),
+    }
+
+    def __init__(self, api_key, base_url, record=None, timeout=5):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.record = record
+        self.timeout = timeout
+
+    def search(self, query, type="web"):
+        if type not in self.endpoints:
+            return None
+        path, extract = self.endpoints[type]
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        res = requests.get(f"{self.base_url}/{path}", params={"q": query}, headers=headers, timeout=self.timeout)
+        results = extract(res.json())
+        if self.record:
+            record_fixture(self.record, f"{type}:{query}", results)
+        return results
+
+class HttpFetch:
+    def __init__(self, record=None):
+        self.record = record
+
+    # headers can carry If-None-Match/If-Modified-Since, the response's validators
+    # come back in meta so the page cache can revalidate later
+    def fetch(self, url, timeout=5, headers=None):
+        res = requests.get(url, timeout=timeout, headers=headers)
+        meta = {
+            "etag": res.headers.get('ETag'),
+            "last_modified": res.headers.get('Last-Modified'),
+            "content_type": res.headers.get('Content-Type', ''),
+        }
+        if self.record and res.status_code != 304:
+            record_fixture(self.record, url, {"status": res.status_code, "text": res.text, **meta})
+        return res.status_code, res.text, meta
+
+class StandIn:
+    # Knobs shared by the local providers: fixed latency plus random jitter in
+    # seconds, and the chance of a call failing with a 429 or another error
+    def __init__(self, options):
+        self.latency = float(options.get('latency', 0))
+        self.jitter = float(options.get('jitter', 0))
+        self.error_rate = float(options.get('error_rate', 0))
+        self.rate_limit_rate = float(options.get('rate_limit_rate', 0))
+        self.fixtures = load_fixtures(options.get('fixtures'))
+        self.rng = random.Random(options.get('seed'))
+
+    def simulate(self):
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            raise ProviderError("429 Too Many Requests (simulated)")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise ProviderError("503 Service Unavailable (simulated)")
+
+class LocalChat(StandIn):
+    def __init__(self, options):
+        super().__init__(options)
+        self.chunk_size = int(options.get('chunk_size', 8))
+        self.token_latency = float(options.get('token_latency', 0))
+
+    def complete(self, prompt):
+        self.simulate()
+        text = self.fixtures.get(prompt_key(prompt))
+        return text if text is not None else self.synthesize(prompt)
+
+    def stream(self, prompt):
+        text = self.complete(prompt)
+        for i in range(0, len(text), self.chunk_size):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield text[i:i + self.chunk_size]
+
+    def synthesize(self, prompt):
+        # Plays the createwithai agent: search once, then exit with cards
+        topic_match = re.search(r'Topic: (.*)', prompt)
+        if not topic_match:
+            return "<p>This is a locally generated explanation.</p>"
+        topic = topic_match.group(1).strip().replace('"', '')[:60]
+        if 'Research so far: No data yet.' in prompt:
+            return f'I need some background first.\nrespond("Searching for {topic}")\nsearch("{topic}")'
+        count_match = re.search(r'create (\d+) more', prompt)
+        count = min(int(count_match.group(1)), 50) if count_match else 5
+        cards = []
+        for i in range(count):
+            digest = hashlib.sha1(f"{topic}-{i}".encode('utf-8')).hexdigest()
+            cards.append({
+                "question": f"{topic} {digest[:8]}?",
+                "answer": f"{digest[8:16]} {digest[16:24]} {digest[24:32]}",
+                "image": None
+            })
+        return f'I have enough to write the cards.\nrespond("Exiting with {count} cards")\nexit({json.dumps(cards)})'
+
+class LocalSearch(StandIn):
+    def __init__(self, options):
+        super().__init__(options)
+        self.results = int(options.get('results', 10))
+
+    def search(self, query, type="web"):
+        if type not in HackclubSearch.endpoints:
+            return None
+        self.simulate()
+        key = f"{type}:{query}"
+        if key in self.fixtures:
+            return self.fixtures[key]
+        slug = re.sub(r'\W+', '-', query.lower()).strip('-')
+        return [{
+            "title": f"{query} result {i + 1}",
+            "url": f"http://localhost/standin/{slug}/{i + 1}",
+            "description": f"Synthetic {type} result {i + 1} for {query}."
+        } for i in range(self.results)]
+
+class LocalFetch(StandIn):
+    def fetch(self, url, timeout=5, headers=None):
+        self.simulate()
+        page = self.fixtures.get(url) or {
+            "text": (f"<html><head><title>{url}</title></head><body><main>"
+                     f"<h1>{url}</h1><p>Synthetic page content for {url}.</p></main></body></html>")
+        }
+        text = page.get('text', '')
+        # Pages without a recorded ETag get one from their content so
+        # revalidation still happens offline
+        meta = {
+            "etag": page.get('etag') or f'"{prompt_key(text)[:16]}"',
+            "last_modified": page.get('last_modified'),
+            "content_type": page.get('content_type', 'text/html'),
+        }
+        if headers and headers.get('If-None-Match') == meta['etag']:
+            return 304, '', meta
+        return page.get('status', 200), text, meta
+
+def make_chat_provider(options):
+    kind = options.get('type', 'openrouter')
+    if kind == 'local':
+        return LocalChat(options)
+    if kind != 'openrouter':
+        raise ValueError(f"Unknown chat provider {kind}")
+    if not has_openrouter:
+        return None
+    return OpenRouterChat(
+        ai_key,
+        options.get('model', model),
+        options.get('server_url', "https://ai.hackclub.com/proxy/v1"),
+        options.get('record'),
+    )
 
-# Initialize AI Client if module exists
-client = None
-if OpenRouter:
-    client = OpenRouter(
-        api_key=ai_key,
-        server_url="https://ai.hackclub.com/proxy/v1",
+def make_search_provider(options):
+    kind = options.get('type', 'hackclub')
+    if kind == 'local':
+        return LocalSearch(options)
+    if kind != 'hackclub':
+        raise ValueError(f"Unknown search provider {kind}")
+    return HackclubSearch(
+        search_key,
+        options.get('base_url', "https://search.hackclub.com/res/v1"),
+        options.get('record'),
+        float(options.get('timeout', 5)),
     )
 
-import time
+def make_fetch_provider(options):
+    kind = options.get('type', 'http')
+    if kind == 'local':
+        return LocalFetch(options)
+    if kind != 'http':
+        raise ValueError(f"Unknown fetch provider {kind}")
+    return HttpFetch(options.get('record'))
+
+chat_provider = make_chat_provider(providers_config.get('chat', {}))
+search_provider = make_search_provider(providers_config.get('search', {}))
+fetch_provider = make_fetch_provider(providers_config.get('fetch', {}))
 
 def ask(prompt):
-    if not client: return "AI Client not initialized"
+    if not chat_provider: return "AI Client not initialized"
     
     try:
-        response = client.chat.send(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            stream=False,
-        )
-        return response.choices[0].message.content
+        return chat_provider.complete(prompt)
         
     except Exception as e:
         if "429" in str(e) or "rate limit" in str(e).lower():
             return "Rate limit reached. Please wait a moment."
         return f"An error occurred: {str(e)}"
 
-def search(query, type="web"):
-    headers = {"Authorization": f"Bearer {search_key}"}
-    if type == "web":
-        url = "https://search.hackclub.com/res/v1/web/search"
-        res = requests.get(url, params={"q": query}, headers=headers)
-        data = res.json()
-        return data.get('web', {}).get('results', [])
-    elif type == "image":
-        url = "https://search.hackclub.com/res/v1/images/search"
-        res = requests.get(url, params={"q": query}, headers=headers)
-        data = res.json()
-        return data.get('results', [])
-    elif type == "news":
-        url = "https://search.hackclub.com/res/v1/news/search"
-        res = requests.get(url, params={"q": query}, headers=headers)
-        data = res.json()
-        return data.get('news', {}).get('results', [])
+def ask_stream(prompt):
+    # Same as ask() but yields the response text as tokens arrive
+    if not chat_provider:
+        yield "AI Client not initialized"
+        return
+
+    try:
+        for text in chat_provider.stream(prompt):
+            yield text
+
+    except Exception as e:
+        if "429" in str(e) or "rate limit" in str(e).lower():
+            yield "Rate limit reached. Please wait a moment."
+        else:
+            yield f"An error occurred: {str(e)}"
+
+# --- Shared search and page cache ---
+# Lots of people make AI sets on the same topics, so search results and fetched
+# pages are cached on disk for everyone in cache/web, keyed by the normalized
+# query or URL. Pages are kept as their main text instead of raw HTML. Expired
+# pages are revalidated with their ETag/Last-Modified, and failures are cached
+# for a short while so a dead link isn't retried every round. Tune it with
+#   "web_cache": {"mb": 64, "search_ttl": 86400, "fetch_ttl": 21600, "error_ttl": 300}
+WEB_CACHE_DIR = 'cache/web'
+WEB_CACHE_MAX_BYTES = int(web_cache_config.get('mb', 64)) * 1024 * 1024
+SEARCH_TTL = float(web_cache_config.get('search_ttl', 24 * 3600))
+FETCH_TTL = float(web_cache_config.get('fetch_ttl', 6 * 3600))
+ERROR_TTL = float(web_cache_config.get('error_ttl', 300))
+PAGE_TEXT_LIMIT = 20000  # characters of text stored per page
+FETCH_CONTEXT_LIMIT = 3000  # characters of it handed to the AI per fetch
+web_cache_lock = threading.Lock()
+# Requests for the same key wait on one lock so a popular topic is only fetched
+# once, striped so the number of locks stays fixed
+web_key_locks = [threading.Lock() for _ in range(256)]
+
+def evict_cache(cache_dir, max_bytes):
+    # Drop the least recently used entries until the directory fits in max_bytes
+    entries = []
+    total = 0
+    with os.scandir(f'{root}{cache_dir}') as it:
+        for entry in it:
+            if entry.name.endswith('.json'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+def normalize_url(url):
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f'{host}:{parts.port}'
+    # Tracking parameters don't change the page
+    query = urllib.parse.urlencode(sorted(
+        (k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith('utm_')
+    ))
+    return urllib.parse.urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+class PageText(HTMLParser):
+    # Collects the readable text of a page, skipping scripts, styles and the
+    # nav/header/footer boilerplate. Text inside <main>/<article> is also kept
+    # separately since that's usually all that matters. A <header>/<footer>
+    # inside <main>/<article> is part of the content (the headline, the byline)
+    # so those are only skipped outside it.
+    skip_tags = {'head', 'script', 'style', 'noscript', 'template', 'svg', 'iframe',
+                 'nav', 'aside', 'button', 'select'}
+    boilerplate_tags = {'header', 'footer'}
+    block_tags = {'p', 'div', 'section', 'article', 'main', 'br', 'li', 'ul', 'ol',
+                  'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'tr', 'table', 'blockquote',
+                  'pre', 'dd', 'dt', 'figcaption', 'caption'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ''
+        self.in_title = False
+        self.skipping = 0
+        self.main_depth = 0
+        self.boilerplate = []  # whether each open header/footer is being skipped
+        self.text = []
+        self.main_text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title':
+            self.in_title = True
+        elif tag == 'body':
+            self.skipping = 0  # in case </head> was left out
+        elif tag in self.skip_tags:
+            self.skipping += 1
+        elif tag in self.boilerplate_tags:
+            self.boilerplate.append(not self.main_depth)
+            if not self.main_depth:
+                self.skipping += 1
+        elif tag in ('main', 'article'):
+            self.main_depth += 1
+        if tag in self.block_tags:
+            self.add('\n')
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self.in_title = False
+        elif tag in self.skip_tags:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.boilerplate_tags:
+            if self.boilerplate and self.boilerplate.pop():
+                self.skipping = max(0, self.skipping - 1)
+        elif tag in ('main', 'article'):
+            self.main_depth = max(0, self.main_depth - 1)
+        if tag in self.block_tags:
+            self.add('\n')
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+        elif not self.skipping:
+            self.add(data)
+
+    def add(self, text):
+        self.text.append(text)
+        if self.main_depth:
+            self.main_text.append(text)
+
+def clean_text(text):
+    lines = (' '.join(line.split()) for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+def page_text(body, content_type=''):
+    if 'html' in content_type or (not content_type and body.lstrip().startswith('<')):
+        parser = PageText()
+        parser.feed(body)
+        parser.close()
+        text = clean_text(''.join(parser.main_text))
+        if len(text) < 200:  # no real <main>, use the whole body
+            text = clean_text(''.join(parser.text))
+        title = clean_text(parser.title)
+        if title:
+            text = f'{title}\n{text}'
     else:
+        text = clean_text(body)
+    return text[:PAGE_TEXT_LIMIT]
+
+def web_cache_file(key):
+    return f'{WEB_CACHE_DIR}/{hashlib.sha1(key.encode("utf-8")).hexdigest()}.json'
+
+def web_key_lock(cache_file):
+    return web_key_locks[int(hashlib.sha1(cache_file.encode('utf-8')).hexdigest()[:8], 16) % len(web_key_locks)]
+
+def load_web_entry(cache_file):
+    entry = readjson(cache_file)
+    if not isinstance(entry, dict):
+        return None
+    if entry.get('expires', 0) > time.time():
+        try:
+            os.utime(f'{root}{cache_file}')  # mark as recently used
+        except FileNotFoundError:
+            pass
+    return entry
+
+def store_web_entry(cache_file, entry):
+    with web_cache_lock:
+        os.makedirs(f'{root}{WEB_CACHE_DIR}', exist_ok=True)
+        writejson(cache_file, entry)
+        evict_cache(WEB_CACHE_DIR, WEB_CACHE_MAX_BYTES)
+
+def search(query, type="web"):
+    if type not in HackclubSearch.endpoints:
         return None
+    key = f'search:{type}:{normalize_query(query)}'
+    cache_file = web_cache_file(key)
+    with web_key_lock(cache_file):
+        entry = load_web_entry(cache_file)
+        now = time.time()
+        if entry and entry.get('expires', 0) > now:
+            if 'error' in entry:
+                raise ProviderError(entry['error'])
+            return entry['results']
+        try:
+            results = search_provider.search(query, type)
+        except Exception as e:
+            if entry and 'results' in entry:
+                return entry['results']  # stale results beat none
+            store_web_entry(cache_file, {"key": key, "expires": now + ERROR_TTL, "error": str(e)})
+            raise
+        store_web_entry(cache_file, {"key": key, "expires": now + SEARCH_TTL, "results": results})
+        return results
+
+def fetch_page(url, timeout=5):
+    # Returns (status, page text). Non-200 statuses and errors are cached for
+    # ERROR_TTL, errors are raised again from the cache.
+    key = f'fetch:{normalize_url(url)}'
+    cache_file = web_cache_file(key)
+    with web_key_lock(cache_file):
+        entry = load_web_entry(cache_file)
+        now = time.time()
+        if entry and entry.get('expires', 0) > now:
+            if 'error' in entry:
+                raise ProviderError(entry['error'])
+            return entry['status'], entry['text']
+
+        stale = entry if entry and entry.get('status') == 200 else None
+        headers = {}
+        if stale and stale.get('etag'):
+            headers['If-None-Match'] = stale['etag']
+        if stale and stale.get('last_modified'):
+            headers['If-Modified-Since'] = stale['last_modified']
+        try:
+            status, body, meta = fetch_provider.fetch(url, timeout=timeout, headers=headers or None)
+        except Exception as e:
+            if stale:
+                return 200, stale['text']
+            store_web_entry(cache_file, {"key": key, "expires": now + ERROR_TTL, "error": str(e)})
+            raise
+
+        if status == 304 and stale:
+            stale['expires'] = now + FETCH_TTL
+            store_web_entry(cache_file, stale)
+            return 200, stale['text']
+        if status != 200:
+            store_web_entry(cache_file, {"key": key, "expires": now + ERROR_TTL, "status": status, "text": ""})
+            return status, ""
+        text = page_text(body, meta.get('content_type') or '')
+        store_web_entry(cache_file, {
+            "key": key,
+            # Don't hold on to a page we got nothing out of for long
+            "expires": now + (FETCH_TTL if text else ERROR_TTL),
+            "status": 200,
+            "text": text,
+            "etag": meta.get('etag'),
+            "last_modified": meta.get('last_modified'),
+        })
+        return 200, text
 
 @app.route('/favicon')
 def favicon():
     return send_file('favicon.png')
 
+# Only this many existing questions go into the prompt, dedup catches the rest
+EXISTING_PROMPT_LIMIT = 40
+
 @app.route('/api/createwithai')
 def createai():
     # 1. Grab all arguments before entering the generator context
     message = request.args.get('message')
     target_questions = request.args.get('target', 5)
-    existingcards = request.args.get('cards', '[]')
+    # Existing cards come from a stored set (set=<title>) or, for unsaved sets,
+    # the cards query param. They are used to dedupe what the agent produces.
+    existing_cards = []
+    set_title = request.args.get('set')
+    if set_title and current_user.is_authenticated:
+        decks = readjson(f'user_data/{current_user.id}/cards.json')
+        deck = next((d for d in decks if d.get('Title') == set_title), None)
+        if deck:
+            existing_cards = resolve_deck(deck).get('content') or []
+    try:
+        extra_cards = json.loads(request.args.get('cards', '[]'))
+        if isinstance(extra_cards, list):
+            existing_cards = existing_cards + extra_cards
+    except json.JSONDecodeError:
+        pass
+    existing_questions = [c.get('question') for c in existing_cards if isinstance(c, dict) and c.get('question')]
+    existingcards = "\n".join(f"- {q}" for q in existing_questions[-EXISTING_PROMPT_LIMIT:]) or "None yet."
 
     @stream_with_context
     def generate():
@@ -334,6 +1044,59 @@ def createai():
 
         accumulated_context = ""
         max_iterations = 20
+        deduper = CardDeduper(existing_cards)
+        streamed = []
+        rejected = []
+        dropped = 0
+
+        def stream_round(prompt):
+            # Streams one agent turn. respond("...") text and each finished card
+            # object are sent to the client while the rest is still generating.
+            nonlocal dropped
+            parser = CardStreamParser()
+            status_sent = False
+            ai_response = ""
+            for text in ask_stream(prompt):
+                ai_response += text
+                if not status_sent:
+                    respond_match = re.search(r'respond\([\'"](.*?)[\'"]\)', ai_response)
+                    if respond_match and respond_match.group(1).strip():
+                        status_sent = True
+                        yield f"data: {json.dumps({'status': respond_match.group(1).strip()})}\n\n"
+                for card in parser.feed(text):
+                    if deduper.add(card):
+                        streamed.append(card)
+                        yield f"data: {json.dumps({'status': 'card', 'card': card})}\n\n"
+                    else:
+                        rejected.append(card)
+                        dropped += 1
+            return ai_response.strip(), parser, status_sent
+
+        def parse_exit(exit_match, parser):
+            # Full exit() JSON if it parses, otherwise whatever cards the stream
+            # parser already recovered (e.g. the model trailed off mid-array)
+            if exit_match:
+                clean_json = exit_match.group(1).replace("```json", "").replace("```", "").strip()
+                try:
+                    card_set = json.loads(clean_json)
+                    return card_set if isinstance(card_set, list) else [card_set]
+                except json.JSONDecodeError:
+                    pass
+            return parser.cards or None
+
+        def finish(card_set):
+            # Cards already streamed were sent as 'card' events, only send the rest
+            nonlocal dropped
+            remaining = []
+            for card in card_set:
+                if not isinstance(card, dict) or card in streamed or card in rejected:
+                    continue
+                if deduper.add(card):
+                    remaining.append(card)
+                else:
+                    dropped += 1
+            total = len(streamed) + len(remaining)
+            yield f"data: {json.dumps({'status': 'complete', 'cards': remaining, 'total': total, 'duplicates': dropped})}\n\n"
 
         try:
             for i in range(max_iterations):
@@ -343,7 +1106,8 @@ def createai():
                 Research so far: {accumulated_context if accumulated_context else "No data yet."}
 
                 You are an AI agent that is for making educational flashcards for a flash card website. You must gather enough data to try and create {target_questions} more or start creating educational flashcards.
-                These are the cards that already exist: {existingcards}
+                The set already has {len(existing_questions)} cards. Some of their questions:
+                {existingcards}
                 Make sure to never duplicate or include already included info.
                 You only have {max_iterations} iterations. This is iteration {i+1}.
                 try to mostly use the information from the search to create the cards.
@@ -367,8 +1131,7 @@ def createai():
                 respond("Searching for population of France to finish card 5")
                 """
 
-                # Call your existing 'ask' function
-                ai_response = ask(agent_prompt).strip()
+                ai_response, parser, status_sent = yield from stream_round(agent_prompt)
 
                 if "rate limit reached" in ai_response.lower():
                     yield f"data: {json.dumps({'error': 'Rate limited by AI provider'})}\n\n"
@@ -380,25 +1143,17 @@ def createai():
                 search_match = re.search(r'search\([\'"](.*?)[\'"]\)', ai_response)
                 fetch_match = re.search(r'fetch\([\'"](.*?)[\'"]\)', ai_response)
                 respond_match = re.search(r'respond\([\'"](.*?)[\'"]\)', ai_response)
-                if not respond_match.group(1).strip():
-                    respond_match = 'Thinking...'
+                status_text = respond_match.group(1).strip() if respond_match else ''
+                status_text = status_text or 'Thinking...'
                 # OPTION 1: EXIT (Success)
-                if exit_match:
-                    raw_json = exit_match.group(1).strip()
-                    # Extract the reasoning by removing the function call from the total string
-                    reasoning = ai_response.replace(exit_match.group(0), "").strip()
-                    
-
-                    clean_json = raw_json.replace("```json", "").replace("```", "").strip()
-                    
-                    try:
-                        card_set = json.loads(clean_json)
-                        yield f"data: {json.dumps({'status': 'complete', 'cards': card_set})}\n\n"
-                        return
-                    except json.JSONDecodeError:
+                if exit_match or parser.cards:
+                    card_set = parse_exit(exit_match, parser)
+                    if card_set is None:
                         yield f"data: {json.dumps({'status': 'AI malformed JSON, retrying...'})}\n\n"
                         accumulated_context += "\nSystem Note: Your last exit() call had invalid JSON. Try again."
                         continue
+                    yield from finish(card_set)
+                    return
 
                 # OPTION 2: SEARCH
                 elif search_match:
@@ -406,7 +1161,8 @@ def createai():
                     # Extract the reasoning
                     reasoning = ai_response.replace(search_match.group(0), "").strip()
                     
-                    yield f"data: {json.dumps({'status': respond_match.group(1).strip()})}\n\n"
+                    if not status_sent:
+                        yield f"data: {json.dumps({'status': status_text})}\n\n"
                     
                     search_results = search(query, type="web")
                     context = "\n\n".join(
@@ -421,14 +1177,15 @@ def createai():
                     reasoning = ai_response.replace(fetch_match.group(0), "").strip()
                     
                     
-                    yield f"data: {json.dumps({'status': respond_match.group(1).strip()})}\n\n"
+                    if not status_sent:
+                        yield f"data: {json.dumps({'status': status_text})}\n\n"
                     
                     try:
-                        res = requests.get(url, timeout=5)
-                        if res.status_code == 200:
-                            accumulated_context += f"\nFetched Content from {url}:\n{res.text[:500]}\n"  # Limit to first 500 chars
+                        status_code, text = fetch_page(url, timeout=5)
+                        if status_code == 200:
+                            accumulated_context += f"\nFetched Content from {url}:\n{text[:FETCH_CONTEXT_LIMIT]}\n"
                         else:
-                            accumulated_context += f"\nFailed to fetch {url}: Status code {res.status_code}\n"
+                            accumulated_context += f"\nFailed to fetch {url}: Status code {status_code}\n"
                     except Exception as e:
                         accumulated_context += f"\nError fetching {url}: {str(e)}\n"
                     continue
@@ -438,16 +1195,15 @@ def createai():
                     accumulated_context += "\nSystem Note: You didn't call search(\"...\") or exit([...]). Please output a valid function call."
                     continue
             # If we exit the loop without returning (Max iterations reached)
-            exitcards = ask(agent_prompt + "\n This is your last iteration. You MUST use the exit([...]) function with the cards in JSON format.")
+            exitcards, parser, status_sent = yield from stream_round(agent_prompt + "\n This is your last iteration. You MUST use the exit([...]) function with the cards in JSON format.")
             exit_match = re.search(r'exit\((.*)\)', exitcards, re.DOTALL)
             
-            if exit_match:
-                clean_json = exit_match.group(1).replace("```json", "").replace("```", "").strip()
-                try:
-                    card_set = json.loads(clean_json)
-                    yield f"data: {json.dumps({'status': 'complete', 'cards': card_set})}\n\n"
-                except:
+            if exit_match or parser.cards:
+                card_set = parse_exit(exit_match, parser)
+                if card_set is None:
                     yield f"data: {json.dumps({'error': 'Final output was not valid JSON.'})}\n\n"
+                else:
+                    yield from finish(card_set)
             else:
                  yield f"data: {json.dumps({'error': 'Failed to generate cards within iteration limit.'})}\n\n"
             return
@@ -457,30 +1213,862 @@ def createai():
 
     return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
-@app.route('/api/savetest', methods=["POST"])
-@login_required
-def savetest():
-    incoming_data = request.json
-    file_path = f'{root}user_data/{current_user.id}/stats.json'
-
-    try:
-        with open(file_path, 'r') as f:
-            current_stats = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        current_stats = {"right": 0, "wrong": 0, "questions": []}
-
+def parse_test_result(incoming_data):
+    # Checks and converts a savetest body before anything is changed, so a bad
+    # one is rejected without touching stats or the summary
+    if not isinstance(incoming_data, dict):
+        raise ValueError("Test result must be an object")
+    test = incoming_data.get('test') or []
+    if not isinstance(test, list):
+        raise ValueError("test must be a list")
+    result = dict(incoming_data)
+    result['right'] = int(incoming_data.get('right') or 0)
+    result['wrong'] = int(incoming_data.get('wrong') or 0)
+    result['test'] = test
+    return result
+
+def apply_test_result(current_stats, incoming_data):
+    current_stats.setdefault('right', 0)
+    current_stats.setdefault('wrong', 0)
+    current_stats.setdefault('questions', [])
     current_stats['right'] += int(incoming_data.get('right', 0))
     current_stats['wrong'] += int(incoming_data.get('wrong', 0))
     if incoming_data.get('percent'):
         current_stats.setdefault(incoming_data.get('setname'), []).append(incoming_data.get('percent'))
-    
+
     if 'test' in incoming_data:
         current_stats['questions'].extend(incoming_data['test'])
 
-    with open(file_path, 'w') as f:
-        json.dump(current_stats, f, indent=4)
+# --- Shared set content ---
+# Importing someone's public set doesn't copy its cards. The content is stored
+# once in shared_sets/<hash>.json and the copy keeps a content_ref to it. The
+# first time the importer saves the set from the editor it gets its own content
+# again, so shared content never changes under anyone.
+def content_hash(content):
+    return hashlib.sha256(json.dumps(content, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+def store_shared_content(content):
+    digest = content_hash(content)
+    if not os.path.exists(f'{root}shared_sets/{digest}.json'):
+        os.makedirs(f'{root}shared_sets', exist_ok=True)
+        writejson(f'shared_sets/{digest}.json', content)
+    return digest
+
+CONTENT_REF_RE = re.compile(r'^[0-9a-f]{64}$')
+
+def is_content_ref(ref):
+    # Refs go straight into a path, only ever accept a sha256 hex digest
+    return isinstance(ref, str) and CONTENT_REF_RE.match(ref) is not None
+
+def resolve_deck(deck, with_content=True):
+    # Gives back a normal set with content for decks that only hold a content_ref
+    ref = deck.get('content_ref') if isinstance(deck, dict) else None
+    if not ref:
+        return deck
+    resolved = {k: v for k, v in deck.items() if k != 'content_ref'}
+    if with_content and is_content_ref(ref):
+        resolved['content'] = readjson(f'shared_sets/{ref}.json')
+    else:
+        resolved['content'] = []
+    return resolved
+
+def shared_copy(source):
+    # source is {"user": owner username, "title": set title} of a public set
+    owner_id = owner_ids_by_username().get(source.get('user'))
+    decks = readjson(f'user_data/{owner_id}/cards.json') if owner_id else []
+    original = next((d for d in decks if d.get('Title') == source.get('title')), None)
+    if not original or original.get('public', True) is not True:
+        raise ValueError(f"Set {source.get('title')} not found")
+    if is_content_ref(original.get('content_ref')):
+        ref = original['content_ref']
+        count = original.get('cards', 0)
+    else:
+        content = original.get('content') or []
+        ref = store_shared_content(content)
+        count = len(content)
+    return {
+        "Title": original.get('Title'),
+        "cards": count,
+        "description": original.get('description'),
+        "content_ref": ref
+    }
+
+def apply_import(all_decks, deck, target_set_title=None):
+    if not isinstance(deck, dict):
+        raise ValueError("Set must be an object")
+    if isinstance(deck.get('source'), dict):
+        deck = shared_copy(deck['source'])
+    else:
+        # Only shared_copy() gets to point a set at shared content
+        deck = {k: v for k, v in deck.items() if k != 'content_ref'}
+    # Returns the cards dropped as duplicates. Saving over an existing set is
+    # the user editing their own cards, so those are kept as they are.
+    dropped = []
+    if isinstance(deck.get('content'), list) and not target_set_title:
+        deck['content'], dropped = dedupe_cards(deck['content'])
+        if 'cards' in deck:
+            deck['cards'] = len(deck['content'])
+    if target_set_title:
+        all_decks[:] = [d for d in all_decks if d.get("Title") != target_set_title]
+    all_decks.append(deck)
+    return dropped
+
+def apply_set_public(all_decks, title, is_public):
+    for deck in all_decks:
+        if deck.get('Title') == title:
+            deck['public'] = is_public
+            return
+    raise KeyError(f"Set {title} not found")
+
+# How many idempotency keys we remember per user, oldest get dropped first
+SYNC_KEYS_LIMIT = 5000
+SYNC_MAX_OPS = 2000
+
+def remember_sync_key(seen, key, result):
+    seen[key] = result
+    while len(seen) > SYNC_KEYS_LIMIT:
+        seen.pop(next(iter(seen)))
+
+def load_stats(user_id):
+    stats = readjson(f'user_data/{user_id}/stats.json')
+    if not isinstance(stats, dict):
+        stats = {"right": 0, "wrong": 0, "questions": []}
+    return stats
+
+# summary.json keeps the small per-user aggregates the dashboard needs (totals,
+# per-set score counters and set metadata) so it never has to parse stats.json
+# or cards.json. It is updated alongside every write to those files.
+SUMMARY_FORMAT = 1
+STATS_RESERVED_KEYS = ('right', 'wrong', 'questions')
+
+def summarize_decks(summary, decks):
+    summary['sets'] = [{
+        "Title": deck.get('Title'),
+        "cards": deck.get('cards', len(deck.get('content') or [])),
+        "description": deck.get('description'),
+        "public": deck.get('public', True) is True
+    } for deck in decks if isinstance(deck, dict)]
+
+def add_percent_to_summary(summary, setname, percent):
+    try:
+        percent = float(percent)
+    except (TypeError, ValueError):
+        return
+    score = summary['scores'].setdefault(setname, {"attempts": 0, "total": 0})
+    score['attempts'] += 1
+    score['total'] += percent
+
+def add_test_to_summary(summary, incoming_data):
+    summary['right'] += int(incoming_data.get('right', 0))
+    summary['wrong'] += int(incoming_data.get('wrong', 0))
+    if incoming_data.get('percent'):
+        add_percent_to_summary(summary, incoming_data.get('setname'), incoming_data.get('percent'))
+
+def memory_score(score):
+    # Same weighting the dashboard used client side: average percent scaled by
+    # how many attempts back it up
+    attempts = score.get('attempts', 0) if score else 0
+    if not attempts:
+        return 0
+    confidence = attempts / (attempts + 2)
+    return round(score['total'] / attempts * confidence, 2)
+
+def new_summary_rev(summary):
+    summary['rev'] = uuid.uuid4().hex
+    return summary
+
+def save_summary(user_id, summary):
+    writejson(f'user_data/{user_id}/summary.json', new_summary_rev(summary))
+
+def rebuild_summary(user_id):
+    stats = load_stats(user_id)
+    summary = {
+        "format": SUMMARY_FORMAT,
+        "right": int(stats.get('right', 0)),
+        "wrong": int(stats.get('wrong', 0)),
+        "scores": {}
+    }
+    for setname, percents in stats.items():
+        if setname in STATS_RESERVED_KEYS or not isinstance(percents, list):
+            continue
+        for percent in percents:
+            add_percent_to_summary(summary, setname, percent)
+    summarize_decks(summary, readjson(f'user_data/{user_id}/cards.json'))
+    return summary
+
+def load_summary(user_id):
+    # Caller must hold user_lock(user_id)
+    summary = readjson(f'user_data/{user_id}/summary.json')
+    if not isinstance(summary, dict) or summary.get('format') != SUMMARY_FORMAT:
+        summary = rebuild_summary(user_id)
+        save_summary(user_id, summary)
+    return summary
+
+def save_decks(user_id, decks, summary=None):
+    # Caller must hold user_lock(user_id)
+    writejson(f'user_data/{user_id}/cards.json', decks)
+    if summary is None:
+        summary = load_summary(user_id)
+    summarize_decks(summary, decks)
+    save_summary(user_id, summary)
+
+# --- Per-card difficulty analytics ---
+# Test records from every learner are rolled up per (set owner, set title, card)
+# into user_data/<owner>/difficulty.json. Each set is stored as parallel columns
+# {"cards": [...], "attempts": [...], "correct": [...], "hard": [...]}.
+DIFFICULTY_FORMAT = 1
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+
+def card_key(record):
+    # Image cards are saved with 'image' as the question, fall back to the answer
+    question = record.get('question')
+    if question and question != 'image':
+        return question
+    return record.get('answer') or question or ''
+
+def load_difficulty(owner_id):
+    data = readjson(f'user_data/{owner_id}/difficulty.json')
+    if not isinstance(data, dict) or data.get('format') != DIFFICULTY_FORMAT:
+        data = {"format": DIFFICULTY_FORMAT, "sets": {}}
+    return data
+
+def add_to_difficulty(sets, title, counters):
+    # counters maps card -> [attempts, correct, hard]
+    columns = sets.setdefault(title, {"cards": [], "attempts": [], "correct": [], "hard": []})
+    index = {card: i for i, card in enumerate(columns['cards'])}
+    for card, (attempts, correct, hard) in counters.items():
+        i = index.get(card)
+        if i is None:
+            i = len(columns['cards'])
+            index[card] = i
+            columns['cards'].append(card)
+            columns['attempts'].append(0)
+            columns['correct'].append(0)
+            columns['hard'].append(0)
+        columns['attempts'][i] += attempts
+        columns['correct'][i] += correct
+        columns['hard'][i] += hard
+
+def owner_ids_by_username():
+    return {u.get('username'): str(u.get('id')) for u in load_users()}
+
+def content_card_keys(content):
+    # The card keys a test of this content can produce, built the same way the
+    # test page builds its records (image data is sent as 'image')
+    keys = set()
+    for card in content:
+        if not isinstance(card, dict):
+            continue
+        question = card.get('question') or card.get('image') or ''
+        answer = card.get('answer') or card.get('image') or ''
+        keys.add(card_key({
+            "question": 'image' if question.startswith('data:') else question,
+            "answer": 'image' if answer.startswith('data:') else answer,
+        }))
+    return keys
+
+def countable_cards(owner_id, title, learner_id, sets):
+    # Card keys of a set records may be counted against, or None if the learner
+    # can't see it. sets caches (public, card keys) per (owner_id, title) and
+    # the owner's decks under (owner_id, None).
+    if (owner_id, title) not in sets:
+        if (owner_id, None) not in sets:
+            decks = readjson(f'user_data/{owner_id}/cards.json')
+            sets[(owner_id, None)] = decks if isinstance(decks, list) else []
+        deck = next((d for d in sets[(owner_id, None)] if isinstance(d, dict) and d.get('Title') == title), None)
+        sets[(owner_id, title)] = deck and (
+            deck.get('public', True) is True,
+            content_card_keys(resolve_deck(deck).get('content') or [])
+        )
+    found = sets[(owner_id, title)]
+    if not found or (owner_id != str(learner_id) and not found[0]):
+        return None
+    return found[1]
+
+def count_records(totals, learner_id, records, owners, sets=None):
+    # totals maps (owner_id, title) -> {card: [attempts, correct, hard]}. Only
+    # records for cards in a set the learner owns or that is public count.
+    sets = {} if sets is None else sets
+    for record in records:
+        if not isinstance(record, dict) or not record.get('setname'):
+            continue
+        owner = record.get('owner')
+        owner_id = owners.get(owner) if owner else str(learner_id)
+        if not owner_id:
+            continue
+        cards = countable_cards(owner_id, record['setname'], learner_id, sets)
+        key = card_key(record)
+        if not cards or key not in cards:
+            continue
+        counters = totals.setdefault((owner_id, record['setname']), {})
+        row = counters.setdefault(key, [0, 0, 0])
+        row[0] += 1
+        # 'w' (and 're-queued' from older clients) is a miss even if the card
+        # was answered right earlier in the same test
+        missed = record.get('userans') in ('w', 're-queued')
+        if not missed and (record.get('userans') == 'r' or (record.get('right') or 0) > 0):
+            row[1] += 1
+        if missed or record.get('isHard'):
+            row[2] += 1
+
+def save_difficulty_totals(totals, replace=False, owner_ids=()):
+    # With replace=True every owner in owner_ids is rewritten, even ones with no records
+    by_owner = {str(owner_id): {} for owner_id in owner_ids}
+    for (owner_id, title), counters in totals.items():
+        by_owner.setdefault(owner_id, {})[title] = counters
+    for owner_id, sets in by_owner.items():
+        if not os.path.isdir(f'{root}user_data/{owner_id}'):
+            continue
+        with user_lock(owner_id):
+            data = {"format": DIFFICULTY_FORMAT, "sets": {}} if replace else load_difficulty(owner_id)
+            for title, counters in sets.items():
+                add_to_difficulty(data['sets'], title, counters)
+            writejson(f'user_data/{owner_id}/difficulty.json', data)
+
+def record_difficulty(learner_id, records):
+    # Incremental update, call without holding the learner's lock
+    totals = {}
+    count_records(totals, learner_id, records, owner_ids_by_username())
+    if totals:
+        save_difficulty_totals(totals)
+
+JSON_TOKEN_RE = re.compile(r'["\[\]{},]')
+JSON_STRING_END_RE = re.compile(r'[\\"]')
+
+def scan_json_element(text, i, state):
+    # Finds where the array element that started earlier ends. state is
+    # [depth, in_string, escape] and carries over between chunks, so every
+    # character is only looked at once. Returns the index just past the
+    # element, or None if it doesn't end in text.
+    depth, in_string, escape = state
+    n = len(text)
+    while i < n:
+        if escape:
+            escape = False
+            i += 1
+        elif in_string:
+            m = JSON_STRING_END_RE.search(text, i)
+            if not m:
+                break
+            i = m.end()
+            if m.group() == '\\':
+                escape = True
+            else:
+                in_string = False
+                if depth == 0:
+                    return i
+        else:
+            m = JSON_TOKEN_RE.search(text, i)
+            if not m:
+                break
+            token = m.group()
+            if token == '"':
+                in_string = True
+                i = m.end()
+            elif token in '[{':
+                depth += 1
+                i = m.end()
+            elif depth == 0:
+                return m.start()  # a number/true/false/null ends at , or ]
+            elif token == ',':
+                i = m.end()
+            else:
+                depth -= 1
+                i = m.end()
+                if depth == 0:
+                    return i
+    state[:] = [depth, in_string, escape]
+    return None
+
+def iter_json_array(path, start=r'\['):
+    # Streams the elements of a JSON array out of a file one at a time so huge
+    # files never have to be loaded whole. start matches up to the array's "["
+    # (by default the top level array, e.g. cards.json). Each element's chunks
+    # are collected until it closes and then decoded once.
+    start_re = re.compile(start)
+    buffer = ""
+    with open(path, 'r') as f:
+        while True:
+            chunk = f.read(JSON_STREAM_CHUNK_SIZE)
+            buffer += chunk
+            match = start_re.search(buffer)
+            if match:
+                break
+            if not chunk:
+                return
+            buffer = buffer[-32:]
+        buffer = buffer[match.end():]
+        pos = 0
+        while True:
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buffer):
+                    break
+                buffer = f.read(JSON_STREAM_CHUNK_SIZE)
+                pos = 0
+                if not buffer:
+                    return
+            if buffer[pos] == ']':
+                return
+            state = [0, False, False]
+            pieces = []
+            end = scan_json_element(buffer, pos, state)
+            while end is None:
+                pieces.append(buffer[pos:])
+                buffer = f.read(JSON_STREAM_CHUNK_SIZE)
+                pos = 0
+                if not buffer:
+                    return  # truncated file
+                end = scan_json_element(buffer, 0, state)
+            pieces.append(buffer[pos:end])
+            yield json.loads(''.join(pieces))
+            pos = end
+
+def iter_stats_questions(path):
+    return iter_json_array(path, r'"questions"\s*:\s*\[')
+
+def rebuild_difficulty():
+    # Recomputes every difficulty.json from the learners' stats.json files.
+    # Memory is bounded by the number of distinct cards, not by test history.
+    totals = {}
+    owners = owner_ids_by_username()
+    users_dir = f'{root}user_data'
+    if not os.path.exists(users_dir):
+        return 0
+    learners = [d for d in os.listdir(users_dir) if os.path.isdir(os.path.join(users_dir, d))]
+    sets = {}
+    for learner_id in learners:
+        stats_path = os.path.join(users_dir, learner_id, 'stats.json')
+        if os.path.exists(stats_path):
+            count_records(totals, learner_id, iter_stats_questions(stats_path), owners, sets)
+    save_difficulty_totals(totals, replace=True, owner_ids=learners)
+    return len(learners)
+
+@app.cli.command('rebuild-difficulty')
+def rebuild_difficulty_command():
+    """Rebuild per-card difficulty analytics from every user's test history."""
+    count = rebuild_difficulty()
+    print(f"Rebuilt difficulty analytics from {count} users")
+
+@app.route('/api/sets/<path:set_id>/difficulty')
+@login_required
+def set_difficulty(set_id):
+    # set_id is "<owner>:<title>" where owner is a user id or username
+    owner, _, title = set_id.partition(':')
+    if not title:
+        return jsonify({"error": "Set id must look like owner:title"}), 400
+    # Only ids and usernames from users.json, owner goes straight into a path
+    owners = owner_ids_by_username()
+    owner_id = owner if owner in owners.values() else owners.get(owner)
+    if not owner_id:
+        return jsonify({"error": "Unknown owner"}), 404
+
+    decks = readjson(f'user_data/{owner_id}/cards.json')
+    deck = next((d for d in decks if d.get('Title') == title), None)
+    if not deck or (str(owner_id) != str(current_user.id) and deck.get('public', True) is not True):
+        return jsonify({"error": "Set not found"}), 404
+
+    columns = load_difficulty(owner_id)['sets'].get(title)
+    cards = []
+    if columns:
+        for card, attempts, correct, hard in zip(columns['cards'], columns['attempts'], columns['correct'], columns['hard']):
+            cards.append({
+                "card": card,
+                "attempts": attempts,
+                "correct_rate": round(correct / attempts, 4) if attempts else 0,
+                "hard_rate": round(hard / attempts, 4) if attempts else 0
+            })
+    # Hardest first
+    cards.sort(key=lambda c: (c['correct_rate'], -c['attempts']))
+    limit = request.args.get('limit', type=int)
+    return jsonify({"owner": owner_id, "title": title, "cards": cards[:limit] if limit else cards}), 200
+
+# --- Export and backups ---
+BACKUP_CHUNK_SIZE = 1024 * 1024
+DATA_URL_RE = re.compile(r'^data:([\w/+.-]+);base64,(.*)$', re.DOTALL)
+
+class ZipStream:
+    # Write-only, unseekable file object for zipfile. Whatever zipfile writes is
+    # buffered until drain() hands it to the response generator.
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, *args):
+        raise OSError("ZipStream is not seekable")
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def export_media(zf, data_url, written):
+    # Stores a data: URL as its own file in the zip, returns its path in the zip
+    match = DATA_URL_RE.match(data_url)
+    if not match:
+        return None
+    try:
+        raw = base64.b64decode(match.group(2))
+    except ValueError:
+        return None
+    ext = match.group(1).split('/')[-1]
+    name = f"media/{hashlib.sha1(raw).hexdigest()}.{ext}"
+    if name not in written:
+        zf.writestr(name, raw)
+        written.add(name)
+    return name
+
+@app.route('/api/export')
+@login_required
+def export():
+    # Streams a zip of the user's sets, the images they use and their stats.
+    # Sets are read one at a time and images are pulled out into media/, so
+    # memory stays flat no matter how big the library is.
+    user_id = current_user.id
+    username = current_user.username
+    cards_path = f'{root}user_data/{user_id}/cards.json'
+    stats_path = f'{root}user_data/{user_id}/stats.json'
+
+    def generate():
+        stream = ZipStream()
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zf:
+            media_written = set()
+            set_files = []
+            if os.path.exists(cards_path):
+                for i, deck in enumerate(iter_json_array(cards_path)):
+                    if not isinstance(deck, dict):
+                        continue
+                    deck = resolve_deck(deck)
+                    for card in deck.get('content') or []:
+                        if not isinstance(card, dict):
+                            continue
+                        for field in ('image', 'question', 'answer'):
+                            value = card.get(field)
+                            if isinstance(value, str) and value.startswith('data:'):
+                                card[field] = export_media(zf, value, media_written) or value
+                        yield stream.drain()
+                    name = f"sets/{i + 1}.json"
+                    zf.writestr(name, json.dumps(deck, indent=4))
+                    set_files.append({"file": name, "Title": deck.get('Title')})
+                    yield stream.drain()
+
+            if os.path.exists(stats_path):
+                with open(stats_path, 'rb') as src, zf.open('stats.json', 'w', force_zip64=True) as dst:
+                    while True:
+                        chunk = src.read(BACKUP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        yield stream.drain()
+
+            zf.writestr('manifest.json', json.dumps({
+                "user": username,
+                "exported": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                "sets": set_files,
+                "media": len(media_written)
+            }, indent=4))
+        yield stream.drain()
+
+    response = Response(stream_with_context(generate()), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{username}-export.zip"'
+    return response
+
+SNAPSHOT_RETRIES = 10
+
+def backup_units():
+    # What a snapshot covers, relative to root, in units that are copied as a
+    # whole: users.json, each user's directory, and shared_sets. shared_sets
+    # comes last since cards.json can point into it, and shared content is
+    # written before anything refers to it and never changes.
+    if os.path.exists(f'{root}users.json'):
+        yield 'users.json'
+    if os.path.isdir(f'{root}user_data'):
+        for name in sorted(os.listdir(f'{root}user_data')):
+            yield f'user_data/{name}'
+    if os.path.isdir(f'{root}shared_sets'):
+        yield 'shared_sets'
+
+def backup_files(unit):
+    if not os.path.isdir(f'{root}{unit}'):
+        yield unit
+        return
+    for dirpath, dirnames, filenames in os.walk(f'{root}{unit}'):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.endswith('.tmp'):
+                yield os.path.relpath(os.path.join(dirpath, name), root)
+
+def unit_state(unit):
+    # Every write swaps in a new file, so a new inode or mtime means it changed
+    state = {}
+    for rel in backup_files(unit):
+        try:
+            st = os.stat(f'{root}{rel}')
+        except FileNotFoundError:
+            continue
+        state[rel] = (st.st_ino, st.st_mtime_ns, st.st_size)
+    return state
+
+def object_path(dest, digest):
+    return os.path.join(dest, 'objects', digest[:2], digest)
+
+def load_manifest(dest, name=None):
+    snapshots_dir = os.path.join(dest, 'snapshots')
+    if name is None:
+        names = sorted(os.listdir(snapshots_dir)) if os.path.isdir(snapshots_dir) else []
+        if not names:
+            return None
+        name = names[-1]
+    elif not name.endswith('.json'):
+        name += '.json'
+    with open(os.path.join(snapshots_dir, name)) as f:
+        return json.load(f)
+
+def store_object(dest, path):
+    # Hashes the file, then copies it into the object store only if that content
+    # isn't there yet. Both passes use the same open file, and the app only ever
+    # swaps files in whole, so the copy always matches the hash.
+    with open(path, 'rb') as src:
+        st = os.fstat(src.fileno())
+        digest = hashlib.sha256()
+        while True:
+            chunk = src.read(BACKUP_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        target = object_path(dest, digest)
+        copied = False
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f'{target}.{uuid.uuid4().hex}.tmp'
+            src.seek(0)
+            with open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, BACKUP_CHUNK_SIZE)
+            os.replace(tmp_path, target)
+            copied = True
+    return {"hash": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}, copied
+
+def take_snapshot(dest):
+    # Incremental: files whose size and mtime match the last snapshot are not
+    # read at all, changed files are hashed and only new content is copied.
+    # The server can be running in another process, so each unit is checked
+    # again after copying and copied over if anything in it changed meanwhile.
+    # That way a user's stats, summary and sync keys always come from the same
+    # moment (a journal.json caught mid commit is kept and replayed on restore).
+    previous = (load_manifest(dest) or {}).get('files', {})
+    files = {}
+    copied = 0
+    for unit in backup_units():
+        for _ in range(SNAPSHOT_RETRIES):
+            before = unit_state(unit)
+            unit_files = {}
+            for rel, (_, mtime_ns, size) in before.items():
+                prev = previous.get(rel)
+                if (prev and prev['size'] == size and prev['mtime_ns'] == mtime_ns
+                        and os.path.exists(object_path(dest, prev['hash']))):
+                    unit_files[rel] = prev
+                    continue
+                try:
+                    unit_files[rel], was_copied = store_object(dest, f'{root}{rel}')
+                except FileNotFoundError:
+                    break
+                copied += was_copied
+            if unit_state(unit) == before:
+                break
+        else:
+            raise click.ClickException(f"{unit} kept changing while it was copied, try again")
+        files.update(unit_files)
+
+    # Names sort in the order snapshots were taken, latest last
+    now = time.time_ns()
+    name = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now // 10**9))}.{now % 10**9:09d}"
+    snapshots_dir = os.path.join(dest, 'snapshots')
+    os.makedirs(snapshots_dir, exist_ok=True)
+    tmp_path = os.path.join(snapshots_dir, f'.{name}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({"name": name, "created": time.time(), "files": files}, f, indent=4)
+    os.replace(tmp_path, os.path.join(snapshots_dir, f'{name}.json'))
+    return name, len(files), copied
+
+def restore_snapshot(dest, name=None, target=None):
+    manifest = load_manifest(dest, name)
+    if manifest is None:
+        raise click.ClickException(f"No snapshots in {dest}")
+    target = os.path.abspath(target or root)
+    for rel, info in manifest['files'].items():
+        out = os.path.abspath(os.path.join(target, rel))
+        if not out.startswith(target + os.sep):
+            raise click.ClickException(f"Refusing to restore {rel} outside {target}")
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        tmp_path = f'{out}.{uuid.uuid4().hex}.tmp'
+        digest = hashlib.sha256()
+        with open(object_path(dest, info['hash']), 'rb') as src, open(tmp_path, 'wb') as dst:
+            while True:
+                chunk = src.read(BACKUP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                dst.write(chunk)
+        if digest.hexdigest() != info['hash']:
+            os.remove(tmp_path)
+            raise click.ClickException(f"Backup object for {rel} is corrupt")
+        os.replace(tmp_path, out)
+
+    # Files the snapshot doesn't have were made after it (summaries, sync keys,
+    # whole new users), remove them so nothing newer is left next to the
+    # rolled back files
+    removed = 0
+    for top in ('user_data', 'shared_sets'):
+        top_dir = os.path.join(target, top)
+        for dirpath, dirnames, filenames in os.walk(top_dir, topdown=False):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if os.path.relpath(path, target) not in manifest['files']:
+                    os.remove(path)
+                    removed += 1
+            if dirpath != top_dir and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+    return manifest['name'], len(manifest['files']), removed
+
+@app.cli.command('snapshot')
+@click.argument('dest')
+def snapshot_command(dest):
+    """Take an incremental backup of users.json, user_data and shared_sets into DEST."""
+    name, total, copied = take_snapshot(dest)
+    print(f"Snapshot {name}: {total} files, {copied} new objects copied")
+
+@app.cli.command('restore')
+@click.argument('dest')
+@click.option('--snapshot', 'name', default=None, help="Snapshot to restore, defaults to the latest")
+@click.option('--target', default=None, help="Directory to restore into, defaults to the app directory")
+def restore_command(dest, name, target):
+    """Restore users.json, user_data and shared_sets from a snapshot in DEST, removing files the snapshot doesn't have."""
+    name, total, removed = restore_snapshot(dest, name, target)
+    print(f"Restored {total} files from snapshot {name}, removed {removed} newer files")
 
+@app.route('/api/savetest', methods=["POST"])
+@login_required
+def savetest():
+    try:
+        incoming_data = parse_test_result(request.get_json(force=True, silent=True) or {})
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    key = incoming_data.get('key')
+    user_dir = f'user_data/{current_user.id}'
+
+    with user_lock(current_user.id):
+        seen = readjson(f'{user_dir}/synced.json')
+        if not isinstance(seen, dict):
+            seen = {}
+        if key and key in seen:
+            return 'ok', 200
+
+        summary = load_summary(current_user.id)
+        current_stats = load_stats(current_user.id)
+        apply_test_result(current_stats, incoming_data)
+        add_test_to_summary(summary, incoming_data)
+        files = {"stats.json": current_stats, "summary.json": new_summary_rev(summary)}
+        if key:
+            remember_sync_key(seen, key, {"status": "applied"})
+            files["synced.json"] = seen
+        commit_user_files(current_user.id, files)
+
+    record_difficulty(current_user.id, incoming_data['test'])
     return 'ok', 200
+
+@app.route('/api/sync', methods=["POST"])
+@login_required
+def sync():
+    # Replays the client's offline queue in one go. Each op looks like
+    # {"key": "<client uuid>", "type": "savetest" | "import" | "setpublic", "body": {...}}
+    # and ops whose key was already applied are skipped so replays don't double count.
+    # savetest bodies match /api/savetest, import is {"data": set, "set": title to replace}
+    # and setpublic is {"name": title, "public": bool}.
+    data = request.get_json(force=True, silent=True)
+    ops = data.get('ops') if isinstance(data, dict) else data
+    if not isinstance(ops, list):
+        return jsonify({"error": "Expected a list of ops"}), 400
+    if len(ops) > SYNC_MAX_OPS:
+        return jsonify({"error": f"Too many ops, max is {SYNC_MAX_OPS}"}), 413
+
+    user_dir = f'user_data/{current_user.id}'
+    os.makedirs(f'{root}{user_dir}', exist_ok=True)
+    results = []
+
+    with user_lock(current_user.id):
+        seen = readjson(f'{user_dir}/synced.json')
+        if not isinstance(seen, dict):
+            seen = {}
+        summary = load_summary(current_user.id)
+        stats = None
+        decks = None
+        test_records = []
+
+        for op in ops:
+            if not isinstance(op, dict):
+                results.append({"key": None, "status": "rejected", "error": "Op must be an object"})
+                continue
+            key = op.get('key')
+            if key and key in seen:
+                results.append({"key": key, "status": "duplicate"})
+                continue
+
+            op_type = op.get('type')
+            body = op.get('body') or {}
+            try:
+                if op_type == 'savetest':
+                    body = parse_test_result(body)
+                    if stats is None:
+                        stats = load_stats(current_user.id)
+                    apply_test_result(stats, body)
+                    add_test_to_summary(summary, body)
+                    test_records.extend(body['test'])
+                elif op_type in ('import', 'setpublic'):
+                    if decks is None:
+                        decks = readjson(f'{user_dir}/cards.json')
+                    if op_type == 'import':
+                        apply_import(decks, body.get('data'), body.get('set'))
+                    else:
+                        apply_set_public(decks, body.get('name'), bool(body.get('public')))
+                else:
+                    raise ValueError(f"Unknown op type {op_type}")
+                result = {"key": key, "status": "applied"}
+            except Exception as e:
+                result = {"key": key, "status": "rejected", "error": str(e)}
+
+            results.append(result)
+            # Rejected ops aren't remembered so the client can fix and resend them
+            if key and result["status"] == "applied":
+                remember_sync_key(seen, key, {"status": "applied"})
+
+        # Everything was applied in memory, now commit the changed files together
+        files = {}
+        if stats is not None:
+            files["stats.json"] = stats
+        if decks is not None:
+            files["cards.json"] = decks
+            summarize_decks(summary, decks)
+        if files:
+            files["summary.json"] = new_summary_rev(summary)
+            files["synced.json"] = seen
+            commit_user_files(current_user.id, files)
+
+    record_difficulty(current_user.id, test_records)
+    return jsonify({"results": results}), 200
+
 @app.route('/api/getpercent')
 @login_required
 def getpercent():
@@ -494,6 +2082,30 @@ def getpercent():
             return jsonify([])
     except Exception as e:
         return jsonify([])
+@app.route('/api/dashboard')
+@login_required
+def dashboard():
+    # Everything the dashboard draws in one request: totals plus each set's
+    # metadata, visibility and memory score. Revalidates with ETag.
+    with user_lock(current_user.id):
+        summary = load_summary(current_user.id)
+    sets = []
+    for deck in summary.get('sets', []):
+        score = summary['scores'].get(deck['Title'])
+        sets.append({
+            **deck,
+            "attempts": score['attempts'] if score else 0,
+            "score": memory_score(score)
+        })
+    response = jsonify({
+        "right": summary['right'],
+        "wrong": summary['wrong'],
+        "sets": sets
+    })
+    response.set_etag(summary['rev'])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
 @app.route('/sw/<name>')
 def sw(name):
     response = make_response(send_from_directory('static', name))
@@ -549,9 +2161,10 @@ def allcards():
                             if username == user:
                                 for card in data:
                                     if card['Title'] == title:
-                                        send.append(card)
+                                        send.append(resolve_deck(card))
                         else:
                             for card in data:
+                                card = resolve_deck(card, with_content=not clear)
                                 if clear:
                                     card['content'].clear()
                                 card['name'] = username
@@ -659,15 +2272,15 @@ def leaderboard():
 @login_required
 def delete():
     name = request.args.get('name')
-    data = readjson(f'user_data/{current_user.id}/cards.json')
-    target = -1
-    for x in range(len(data)):
-        if data[x]["Title"] == name:
-            target = x
-            break
-    data.pop(target)
-    with open(f'user_data/{current_user.id}/cards.json', 'w') as f:
-        json.dump(data, f, indent=4)
+    with user_lock(current_user.id):
+        data = readjson(f'user_data/{current_user.id}/cards.json')
+        target = -1
+        for x in range(len(data)):
+            if data[x]["Title"] == name:
+                target = x
+                break
+        data.pop(target)
+        save_decks(current_user.id, data)
     return redirect(url_for('dash'))
 
 # --- NEW ROUTES ADDED HERE ---
@@ -694,21 +2307,14 @@ def set_public():
     is_public = is_public_str == 'true'
     
     file_path = f'user_data/{current_user.id}/cards.json'
-    cards = readjson(file_path)
-    updated = False
-    
-    for card in cards:
-        if card.get('Title') == title:
-            card['public'] = is_public
-            updated = True
-            break
-            
-    if updated:
-        with open(f'{root}{file_path}', 'w') as f:
-            json.dump(cards, f, indent=4)
-        return 'Status updated', 200
-    else:
-        return 'Card not found', 404
+    with user_lock(current_user.id):
+        cards = readjson(file_path)
+        try:
+            apply_set_public(cards, title, is_public)
+        except KeyError:
+            return 'Card not found', 404
+        save_decks(current_user.id, cards)
+    return 'Status updated', 200
 # -----------------------------
 @app.route('/api/explain')
 @login_required
@@ -753,6 +2359,32 @@ def dash():
 def create():
     return render_template('create.html')
 
+# Parsed PDFs are cached by content hash, so a class uploading the same Quizlet
+# export only parses it once. Least recently used entries go first when the
+# cache is over its size cap.
+PDF_CACHE_DIR = 'cache/pdf'
+PDF_CACHE_MAX_BYTES = int(pdf_cache_mb) * 1024 * 1024
+pdf_cache_lock = threading.Lock()
+
+def cached_parse_pdf(pdf_stream):
+    data = pdf_stream.read()
+    digest = hashlib.sha256(data).hexdigest()
+    cache_file = f'{PDF_CACHE_DIR}/{digest}.json'
+    cached = readjson(cache_file)
+    if isinstance(cached, dict) and 'cards' in cached:
+        try:
+            os.utime(f'{root}{cache_file}')  # mark as recently used
+        except FileNotFoundError:
+            pass
+        return cached['title'], cached['cards']
+
+    title, cards = parse_hybrid_quizlet_pdf(io.BytesIO(data))
+    with pdf_cache_lock:
+        os.makedirs(f'{root}{PDF_CACHE_DIR}', exist_ok=True)
+        writejson(cache_file, {"title": title, "cards": cards})
+        evict_cache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+    return title, cards
+
 @app.route("/api/parse-pdf", methods=["POST"])
 @login_required
 def parse_pdf():
@@ -762,7 +2394,7 @@ def parse_pdf():
     file = request.files['file']
     desc = request.form.get('desc')
     try:
-        title, cards = parse_hybrid_quizlet_pdf(file)
+        title, cards = cached_parse_pdf(file)
         
         return jsonify([{
             "Title": title or "Imported Set",
@@ -783,29 +2415,22 @@ def import_set():
 
         target_set_title = request.args.get('set')
 
-        import os, json
-        cards_file = os.path.join(root, f'user_data/{current_user.id}/cards.json')
-        
-        if os.path.exists(cards_file):
-            with open(cards_file, "r") as f:
-                all_decks = json.load(f)
-        else:
-            all_decks = []
-
-
-        if target_set_title:
+        cards_file = f'user_data/{current_user.id}/cards.json'
 
-            all_decks = [deck for deck in all_decks if deck.get("Title") != target_set_title]
-
-
-        all_decks.append(data)
-
-        with open(cards_file, "w") as f:
-            json.dump(all_decks, f, indent=4)
+        with user_lock(current_user.id):
+            all_decks = readjson(cards_file)
+            dropped = apply_import(all_decks, data, target_set_title)
+            save_decks(current_user.id, all_decks)
 
         return jsonify({
             "status": "success", 
-            "message": f"Updated {target_set_title}" if target_set_title else "Appended new set"
+            "message": f"Updated {target_set_title}" if target_set_title else "Appended new set",
+            "duplicates_removed": len(dropped),
+            # Text only so the editor can tell which of its cards were dropped
+            "duplicates": [
+                {"question": card.get('question'), "answer": card.get('answer')}
+                for card in dropped if isinstance(card, dict)
+            ]
         }), 200
 
     except Exception as e:
@@ -836,7 +2461,8 @@ def get_cards():
     cards = readjson(f'user_data/{user_id}/cards.json')
     if cardset:
         target_content = next((item for item in cards if item["Title"] == cardset), None)
-        return jsonify(target_content)
+        return jsonify(resolve_deck(target_content))
+    cards = [resolve_deck(deck, with_content=not clear) for deck in cards]
     if clear:
         try:
             cards[0]['content'].clear()
@@ -861,12 +2487,11 @@ def register():
             "password": generate_password_hash(password)
         })
 
-        with open(f"{root}users.json", "w") as f:
-            json.dump(users, f, indent=4)
-            try:
-                os.makedirs(f'{root}user_data/{uid}', exist_ok=True)
-            except OSError:
-                pass
+        writejson("users.json", users)
+        try:
+            os.makedirs(f'{root}user_data/{uid}', exist_ok=True)
+        except OSError:
+            pass
         return redirect(url_for("login"))
 
     return render_template("register.html")
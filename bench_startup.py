@@ -0,0 +1,99 @@
+"""Measures how long a fresh worker takes to import app.py and how much memory it uses.
+
+python bench_startup.py            print a report
+python bench_startup.py --check    also exit 1 if it's over the budget in startup_budget.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+budget_file = os.path.join(here, 'startup_budget.json')
+
+# ru_maxrss is in KB on Linux and bytes on macOS
+rss_snippet = (
+    "import app, resource, sys\n"
+    "rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+    "print(rss // 1024 if sys.platform == 'darwin' else rss)"
+)
+
+def import_times():
+    # Runs `python -X importtime -c "import app"` and returns its rows as
+    # (depth, module, self_us, cumulative_us)
+    out = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=here, capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+def app_children(rows):
+    # importtime lists children before their parent, so app's direct imports are
+    # the depth 1 rows between the previous top level import and app itself
+    end = next(i for i, row in enumerate(rows) if row[0] == 0 and row[1] == 'app')
+    children = []
+    for row in reversed(rows[:end]):
+        if row[0] == 0:
+            break
+        if row[0] == 1:
+            children.append(row)
+    return children
+
+def worker_rss_kb():
+    out = subprocess.run([sys.executable, '-c', rss_snippet], cwd=here, capture_output=True, text=True, check=True).stdout
+    return int(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="how many fresh interpreters to measure")
+    parser.add_argument('--top', type=int, default=15, help="how many imports to list in the breakdown")
+    parser.add_argument('--check', action='store_true', help="fail if over startup_budget.json")
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.runs)]
+    totals = [next(cum for depth, name, _, cum in rows if depth == 0 and name == 'app') for rows in runs]
+    rss = [worker_rss_kb() for _ in range(args.runs)]
+    import_ms = statistics.median(totals) / 1000
+    rss_mb = statistics.median(rss) / 1024
+
+    print(f"import app: {import_ms:.1f} ms (median of {args.runs})")
+    print(f"worker RSS after import: {rss_mb:.1f} MB")
+    print(f"\nSlowest imports pulled in by app (last run):")
+    direct = sorted(app_children(runs[-1]), key=lambda row: row[3], reverse=True)
+    for _, name, _, cumulative in direct[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    if not args.check:
+        return 0
+
+    with open(budget_file) as f:
+        budget = json.load(f)
+    imported = {name for _, name, _, _ in runs[-1]}
+    problems = []
+    if import_ms > budget['import_ms']:
+        problems.append(f"import took {import_ms:.1f} ms, budget is {budget['import_ms']} ms")
+    if rss_mb > budget['rss_mb']:
+        problems.append(f"worker RSS is {rss_mb:.1f} MB, budget is {budget['rss_mb']} MB")
+    for name in budget.get('lazy_modules', []):
+        if name in imported:
+            problems.append(f"{name} is imported at startup but should load on first use")
+
+    if problems:
+        print("\nStartup budget exceeded:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    print("\nWithin startup budget")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())